@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+
+"""
+Re-generate tinytex/_lextab.py. Run this whenever tinytex/lextokens.py
+or the arguments to ply.lex.lex() in tinytex/parser.py change, because
+PLY will happily keep using an outdated table.
+"""
+
+import os, importlib
+
+import tinytex
+
+def main():
+    lextab = os.path.join(tinytex.__path__[0], "_lextab.py")
+    if os.path.exists(lextab):
+        os.unlink(lextab)
+
+    # Building the lexer writes a new table.
+    importlib.import_module("tinytex.parser")
+    print("Wrote", lextab)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# Copyright (C) 2025 Diedrich Vorberg
+#
+# Contact: diedrich@tux4web.de
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+
+import unittest
+
+from tinytex.parser import tex_base_lexer
+
+def tokens(source):
+    lexer = tex_base_lexer.clone()
+    lexer.input(source)
+    return [ (token.type, token.value) for token in lexer ]
+
+def types(source):
+    return [ type for type, value in tokens(source) ]
+
+class LexerTest(unittest.TestCase):
+    def test_words_split_at_blanks(self):
+        self.assertEqual(tokens("Hello World!"),
+                         [ ("word", "Hello"),
+                           ("whitespace", " "),
+                           ("word", "World!"), ])
+
+    def test_comments_are_dropped(self):
+        self.assertEqual(types("a% comment\n  b"), [ "word", "word", ])
+        self.assertEqual(types("a% comment"), [ "word", ])
+
+    def test_comments_keep_blank_lines(self):
+        self.assertEqual(types("a % comment\n\nb"),
+                         [ "word", "whitespace", "eols", "word", ])
+        self.assertEqual(types("% comment\n\nb"), [ "eols", "word", ])
+
+    def test_environments(self):
+        self.assertEqual(tokens(r"\begin{document}\end{document}"),
+                         [ ("begin_environment", "document"),
+                           ("end_environment", "document"), ])
+
+    def test_commands(self):
+        self.assertEqual(tokens(r"\emph\section*"),
+                         [ ("command", "emph"),
+                           ("command", "section*"), ])
+
+    def test_uppercase_begin_is_a_command(self):
+        self.assertEqual(tokens(r"\BEGIN{x}")[0], ("command", "BEGIN"))
+
+    def test_line_ends(self):
+        self.assertEqual(types("a\nb"), [ "word", "whitespace", "word", ])
+        self.assertEqual(types("a\n\n  b"), [ "word", "eols", "word", ])
+        self.assertEqual(types("a\\\\\nb"), [ "word", "linebreak", "word", ])
+
+    def test_placeholders(self):
+        self.assertEqual(tokens("#1"), [ ("placeholder", "#1"), ])
+        self.assertEqual(tokens("#12"), [ ("placeholder", "#1"),
+                                          ("word", "2"), ])
+        self.assertEqual(types("#0"), [ "text", "word", ])
+
+    def test_definition_commands(self):
+        self.assertEqual(types(r"\newcommand\renewcommand"
+                               r"\NewDocumentCommand"),
+                         [ "user_def_command" ] * 3)
+        self.assertEqual(tokens(r"\newcommandx"),
+                         [ ("command", "newcommandx"), ])
+        self.assertEqual(tokens(r"\newcommand*"),
+                         [ ("command", "newcommand*"), ])
+
+if __name__ == "__main__":
+    unittest.main()
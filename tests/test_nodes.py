@@ -0,0 +1,85 @@
+# Copyright (C) 2025 Diedrich Vorberg
+#
+# Contact: diedrich@tux4web.de
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+
+import io, unittest
+
+from tinytex.nodes import (Root, Environment, Command, OptionalParameter,
+                           RequiredParameter, Whitespace, Text)
+
+class NodesTest(unittest.TestCase):
+    def test_walk(self):
+        root = Root()
+        env = root.append(Environment("a"))
+        x = env.append(Text("x"))
+        y = root.append(Text("y"))
+        self.assertEqual(list(root.walk(Text)), [ x, y, ])
+        self.assertIs(root.first(Text), x)
+        self.assertIsNone(root.first(Command))
+
+    def test_text_follows_append(self):
+        root = Root()
+        env = root.append(Environment("a"))
+        env.append(Text("x"))
+        self.assertEqual(root.text, "x")
+
+        # Appending below a node with a cached text drops the caches
+        # up to the root.
+        env.append(Whitespace())
+        env.append(Text("y"))
+        self.assertEqual(root.text, "x y")
+        self.assertEqual(env.text, "x y")
+
+    def test_command_parameters(self):
+        command = Command("f")
+        o = command.append(OptionalParameter())
+        r = command.append(RequiredParameter())
+        p = command.append(OptionalParameter())
+        self.assertEqual(command.parameters, [ o, r, p, ])
+        self.assertEqual(command.optional_parameters, [ o, p, ])
+        self.assertEqual(command.required_parameters, [ r, ])
+
+    def test_command_copy(self):
+        command = Command("f")
+        o = command.append(OptionalParameter())
+        r = command.append(RequiredParameter())
+        children = [ o, r, ]
+        copy = command.copy(children)
+        self.assertIs(copy.children, children)
+        self.assertEqual(copy.optional_parameters, [ o, ])
+        self.assertEqual(copy.required_parameters, [ r, ])
+
+    def test_print(self):
+        root = Root()
+        root.append(Environment("a")).append(Text("x"))
+        out = io.StringIO()
+        root.print(file=out)
+        self.assertEqual(out.getvalue().splitlines(),
+                         [ " Root(1)", "   Environment “a” (1)",
+                           "     Text(“x”)", ])
+
+    def test_walk_up_to(self):
+        root = Root()
+        env = root.append(Environment("a"))
+        command = env.append(Command("emph"))
+        text = command.append(RequiredParameter()).append(Text("x"))
+        self.assertIs(text.walk_up_to(Environment), env)
+        self.assertIs(text.walk_up_to(Command), command)
+        self.assertIs(text.walk_up_to(Root), root)
+
+        # There is no OptionalParameter above the text.
+        self.assertIsNone(text.walk_up_to(OptionalParameter))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,261 @@
+# Copyright (C) 2025 Diedrich Vorberg
+#
+# Contact: diedrich@tux4web.de
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+
+import unittest
+
+from tinymarkup.exceptions import ParseError
+from tinytex.parser import TexParser
+from tinytex.compiler import TexCompiler
+from tinytex.nodes import (Root, Command, OptionalParameter,
+                           RequiredParameter, ParagraphBreak,
+                           BeginScope, EndScope, Whitespace, Text,
+                           Placeholder)
+from tinytex.user_commands import (UserCommandParseError,
+                                   OldStyleNewCommand, find_user_commands)
+
+def parse(source):
+    return TexParser().parse(source, TexCompiler())
+
+def flat(nodes):
+    """
+    Return a string that shows the structure of “nodes”: Text as it is,
+    Whitespace as a blank, commands with their parameters and scopes
+    in TeX notation and paragraph breaks as \\par.
+    """
+    ret = []
+    for node in nodes:
+        if isinstance(node, Command):
+            ret.append("\\" + node.command)
+            ret.append(flat(node.children))
+        elif isinstance(node, OptionalParameter):
+            ret.append("[" + flat(node.children) + "]")
+        elif isinstance(node, RequiredParameter):
+            ret.append("{" + flat(node.children) + "}")
+        elif isinstance(node, BeginScope):
+            ret.append("{")
+        elif isinstance(node, EndScope):
+            ret.append("}")
+        elif isinstance(node, ParagraphBreak):
+            ret.append("\\par ")
+        elif isinstance(node, Whitespace):
+            ret.append(" ")
+        elif isinstance(node, Text):
+            ret.append(node.text)
+        else:
+            ret.append(flat(node.children))
+    return "".join(ret)
+
+def expand(source):
+    return flat(parse(source).children)
+
+def command(name, *parameters):
+    """
+    Build a Command node by hand. Each of “parameters” is a list of
+    nodes, put in a RequiredParameter, or a string, put in an
+    OptionalParameter as text.
+    """
+    ret = Command(name)
+    for parameter in parameters:
+        if type(parameter) is str:
+            ret.append(OptionalParameter()).append(Text(parameter))
+        else:
+            required = ret.append(RequiredParameter())
+            for node in parameter:
+                required.append(node)
+    return ret
+
+class ParserTest(unittest.TestCase):
+    def test_parse_returns_the_tree(self):
+        self.assertIsInstance(parse("x"), Root)
+
+    def test_structure(self):
+        self.assertEqual(expand(r"\emph[x]{y} {\bf z}"),
+                         r"\emph[x]{y} {\bf z}")
+
+    def test_comments(self):
+        self.assertEqual(expand("a% comment\n  b"), "ab")
+
+    def test_comment_before_blank_line(self):
+        self.assertEqual(expand("a% comment\n\nb"), r"a\par b")
+        self.assertEqual(expand("% comment\n\nb"), r"\par b")
+
+    def test_environments(self):
+        self.assertEqual(expand(r"\begin{a}x\end{a}"), "x")
+        with self.assertRaisesRegex(ParseError, "“b”"):
+            parse(r"\begin{a}x\end{b}")
+        with self.assertRaisesRegex(ParseError, "Not in an environment"):
+            parse(r"x\end{a}")
+
+    def test_text(self):
+        self.assertEqual(parse("a{b} c").text, "ab c")
+
+    def test_paragraphs(self):
+        self.assertEqual(expand("a\n\nb"), r"a\par b")
+
+class UserCommandsTest(unittest.TestCase):
+    def test_documents_share_no_nodes(self):
+        source = r"\newcommand{\x}{Some \emph{text}}\x"
+        first = parse(source).children
+        second = parse(source).children
+        self.assertEqual(flat(first), flat(second))
+        for a, b in zip(first, second):
+            self.assertIsNot(a, b)
+
+    def test_nested_expansion(self):
+        self.assertEqual(expand(r"\newcommand{\a}{A}"
+                                r"\newcommand{\b}[1]{<#1\a>}"
+                                r"\b{\a}"), "<AA>")
+
+    def test_scopes_in_expansions(self):
+        self.assertEqual(expand(r"\newcommand{\f}[1]{<{#1}>}\f{\f{x}}"),
+                         "<{<{x}>}>")
+
+    def test_self_recursion(self):
+        with self.assertRaisesRegex(UserCommandParseError, "Capacity"):
+            parse(r"\newcommand{\foo}{x\foo}\foo")
+        with self.assertRaisesRegex(UserCommandParseError, "Capacity"):
+            parse(r"\newcommand{\r}{\r}\r")
+
+    def test_mutual_recursion(self):
+        with self.assertRaisesRegex(UserCommandParseError, "Capacity"):
+            parse(r"\newcommand{\a}{\b}\newcommand{\b}{<\a>}\a")
+
+    def test_recursion_through_parameters(self):
+        with self.assertRaisesRegex(UserCommandParseError, "Capacity"):
+            parse(r"\newcommand{\f}[1]{\emph{\f{#1}}}\f{x}")
+
+    def test_finite_nesting(self):
+        source = r"\newcommand{\c0}{x}"
+        for i in range(1, 10):
+            source += r"\newcommand{\c%i}{<\c%i>}" % (i, i-1)
+        self.assertEqual(expand(source + r"\c9"), "<<<<<<<<<x>>>>>>>>>")
+
+    def test_use_before_definition(self):
+        self.assertEqual(expand(r"\x \newcommand{\x}{X}\x"), r"\x X")
+
+    def test_redefinition(self):
+        self.assertEqual(expand(r"\newcommand{\x}{X}\x"
+                                r"\renewcommand{\x}{Y}\x"), "XY")
+
+    def test_definition_places(self):
+        # Definitions count in the Root and in Environments …
+        self.assertEqual(expand(r"\begin{a}\newcommand{\x}{X}\end{a}\x"),
+                         "X")
+        # … and where an expansion puts them, …
+        self.assertEqual(expand(r"\newcommand{\d}{\newcommand{\x}{X}}"
+                                r"\d\x"), "X")
+        # … but not in parameters.
+        self.assertEqual(expand(r"\emph{\newcommand{\x}{X}}\x"),
+                         r"\emph{}\x")
+
+    def test_xparse_without_command(self):
+        for source in ( r"\NewDocumentCommand{\g}{m}{x}",
+                        r"\NewDocumentCommand x", ):
+            with self.assertRaisesRegex(UserCommandParseError,
+                                        "followed by the command"):
+                parse(source)
+
+    def test_expansion_cache(self):
+        f = OldStyleNewCommand(command("newcommand",
+                                       [ command("f"), ], "1", "dflt",
+                                       [ Text("<"), Placeholder("#1"),
+                                         Text(">"), ]))
+        # Calls without parameters share their expansion, which can’t
+        # be modified…
+        self.assertIs(f.call(command("f")), f.call(command("f")))
+        self.assertIsInstance(f.call(command("f")), tuple)
+        self.assertEqual(flat(f.call(command("f"))), "<dflt>")
+
+        # … calls with parameters don’t.
+        self.assertIsNot(f.call(command("f", "x")),
+                         f.call(command("f", "x")))
+        self.assertEqual(flat(f.call(command("f", "x"))), "<x>")
+
+        f.clear_cache()
+        self.assertEqual(flat(f.call(command("f"))), "<dflt>")
+
+    def test_newcommand(self):
+        self.assertEqual(expand(r"\newcommand{\x}{X}\x \x"), "X X")
+
+    def test_parameters(self):
+        self.assertEqual(expand(r"\newcommand{\f}[2]{<#2|#1>}\f{a}{b}"),
+                         "<b|a>")
+        self.assertEqual(expand(r"\newcommand{\f}[1]{<\emph{#1} x>}\f{a}"),
+                         r"<\emph{a} x>")
+
+    def test_bad_nargs(self):
+        with self.assertRaisesRegex(UserCommandParseError, "“x”"):
+            parse(r"\newcommand{\f}[x]{#1}")
+
+    def test_illegal_parameter_number(self):
+        with self.assertRaises(UserCommandParseError):
+            parse(r"\newcommand{\f}[1]{#2}")
+        with self.assertRaises(UserCommandParseError):
+            parse(r"\newcommand{\f}{#1}")
+
+    def test_optional_default(self):
+        source = r"\newcommand{\f}[2][dflt]{<#1|#2>}"
+        self.assertEqual(expand(source + r"\f{x}"), "<dflt|x>")
+        self.assertEqual(expand(source + r"\f[y]{x}"), "<y|x>")
+
+        # Defaults are not shared between documents.
+        def default():
+            root = parse(source + r"\f{x}")
+            return [ node for node in root.walk(Text)
+                     if node.text == "dflt" ][0]
+        self.assertIsNot(default(), default())
+
+    def test_empty_optional_default(self):
+        self.assertEqual(expand(r"\newcommand{\f}[2][]{<#1|#2>}\f{x}"),
+                         "<|x>")
+
+    def test_default_without_scope(self):
+        for argspec in ( "O", "O x", ):
+            with self.assertRaisesRegex(UserCommandParseError, "Scope"):
+                parse(r"\NewDocumentCommand\T{%s}{#1}" % argspec)
+
+    def test_argument_mismatch(self):
+        with self.assertRaises(UserCommandParseError):
+            parse(r"\newcommand{\f}[1]{#1}\f")
+
+    def test_xparse(self):
+        source = r"\NewDocumentCommand\T{O{ab {c}} o m}{<#1|#2|#3>}"
+        self.assertEqual(expand(source + r"\T{x}"), "<ab {c}||x>")
+        self.assertEqual(expand(source + r"\T[y][z]{x}"), "<y|z|x>")
+        self.assertEqual(expand(source + r"\T{x}\T{y}"),
+                         "<ab {c}||x><ab {c}||y>")
+
+    def test_unknown_argspec_letter(self):
+        with self.assertRaisesRegex(UserCommandParseError, "“s”"):
+            parse(r"\NewDocumentCommand\T{s m}{#2}")
+
+    def test_repr(self):
+        f = OldStyleNewCommand(command("newcommand", [ command("f"), ],
+                                       "2", "d", []))
+        self.assertEqual(repr(f), "<OldStyleNewCommand(2, 'd')>")
+        g = OldStyleNewCommand(command("newcommand", [ command("g"), ], []))
+        self.assertEqual(repr(g), "<OldStyleNewCommand(0, None)>")
+
+    def test_find_user_commands(self):
+        root = Root()
+        root.append(command("newcommand", [ command("a"), ], [ Text("A"), ]))
+        root.append(command("emph", [ command("newcommand",
+                                              [ command("b"), ],
+                                              [ Text("B"), ]), ]))
+        self.assertEqual([ cmd.name for cmd in find_user_commands(root) ],
+                         [ "a", ])
+
+if __name__ == "__main__":
+    unittest.main()
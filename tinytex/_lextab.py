@@ -0,0 +1,10 @@
+# _lextab.py. This file automatically created by PLY (version 3.11). Don't edit!
+_tabversion   = '3.10'
+_lextokens    = set(('begin_environment', 'close_curly', 'close_oparam', 'command', 'end_environment', 'eols', 'linebreak', 'open_curly', 'open_oparam', 'placeholder', 'text', 'user_def_command', 'whitespace', 'word'))
+_lexreflags   = 8
+_lexliterals  = ''
+_lexstateinfo = {'INITIAL': 'inclusive'}
+_lexstatere   = {'INITIAL': [('(?P<t_command>\\\\(?:begin{(?P<benv>\\w+)}|end{(?P<eenv>\\w+)}|(?P<definition>(?:re)?newcommand|NewDocumentCommand)(?![a-zA-Z0-9*])|(?P<command>[a-zA-Z][a-zA-Z0-9]*\\*?)))|(?P<t_eols>\\n\\n+\\s*)|(?P<t_ignore_comment>%[^\\n]*(?:\\n(?![ \\t]*\\n)[ \\t]*)?)|(?P<t_word>[\\w„“”\\.!\\?;,‘’]+)|(?P<t_whitespace>[ \\t]+|\\n(?!\\n))|(?P<t_linebreak>\\\\\\\\\\n)|(?P<t_placeholder>#[1-9])|(?P<t_close_curly>\\})|(?P<t_close_oparam>\\])|(?P<t_open_curly>\\{)|(?P<t_open_oparam>\\[)|(?P<t_text>.)', [None, ('t_command', 'command'), None, None, None, None, ('t_eols', 'eols'), (None, None), (None, 'word'), (None, 'whitespace'), (None, 'linebreak'), (None, 'placeholder'), (None, 'close_curly'), (None, 'close_oparam'), (None, 'open_curly'), (None, 'open_oparam'), (None, 'text')])]}
+_lexstateignore = {'INITIAL': ''}
+_lexstateerrorf = {'INITIAL': 't_error'}
+_lexstateeoff = {}
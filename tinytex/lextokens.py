@@ -16,11 +16,11 @@ from tinymarkup.exceptions import Location, LexerSetupError
 
 
 tokens = ( "begin_environment", "end_environment",
-           "command",
+           "command", "user_def_command",
            "open_oparam", "close_oparam",
            "open_curly", "close_curly", # curly is either ProcMarkup or ReqParam
            "linebreak", "eols",
-           "comment", "whitespace",
+           "whitespace",
            "placeholder",
            "word", "text", )
 
@@ -29,19 +29,25 @@ tokens = ( "begin_environment", "end_environment",
 #    token.value = token.lexer.lexmatch.groupdict()["proc"]
 #    return token
 
-def t_begin_environment(token):
-    r"\\begin{(?P<benv>\w+)}"
-    token.value = token.lexer.lexmatch.groupdict()["benv"]
-    return token
-
-def t_end_environment(token):
-    r"\\end{(?P<eenv>\w+)}"
-    token.value = token.lexer.lexmatch.groupdict()["eenv"]
-    return token
-
 def t_command(token):
-    r"\\(?P<command>[a-zA-Z][a-zA-Z0-9]*\*?)"
-    token.value = token.lexer.lexmatch.groupdict()["command"]
+    r"\\(?:begin{(?P<benv>\w+)}|end{(?P<eenv>\w+)}|(?P<definition>(?:re)?newcommand|NewDocumentCommand)(?![a-zA-Z0-9*])|(?P<command>[a-zA-Z][a-zA-Z0-9]*\*?))"
+    # One rule for everything starting with a backslash. The named group
+    # that matched determines the token’s type. The commands that
+    # define user commands (see user_commands.definition_commands) get
+    # a token type of their own, so the parser can tell them apart
+    # without looking at the name.
+    groups = token.lexer.lexmatch.groupdict()
+    if groups["benv"] is not None:
+        token.type = "begin_environment"
+        token.value = groups["benv"]
+    elif groups["eenv"] is not None:
+        token.type = "end_environment"
+        token.value = groups["eenv"]
+    elif groups["definition"] is not None:
+        token.type = "user_def_command"
+        token.value = groups["definition"]
+    else:
+        token.value = groups["command"]
     return token
 
 t_open_oparam = r"\["
@@ -54,15 +60,19 @@ t_linebreak = r"\\\\\n"
 
 def t_eols(t):
     r"\n\n+\s*"
-    t.value = "\n" * t.value.count("\n")
+    # The parser only looks at the token type.
     return t
 
-t_comment = "%.*?[\n$]\s*"
+# A comment swallows the line’s end and the next line’s indentation,
+# as TeX does, unless the next line is blank: That still ends the
+# paragraph. PLY drops t_ignore_* matches without ever passing them
+# to the parser.
+t_ignore_comment = r"%[^\n]*(?:\n(?![ \t]*\n)[ \t]*)?"
 t_whitespace = r"[ \t]+|\n(?!\n)"
 
-t_placeholder = r"#(\d+)"
+t_placeholder = r"#[1-9]"
 chars = r"\w„“”\.!\?;,‘’"
-t_word = f"[{chars}][{chars} \t]*[{chars}]"
+t_word = f"[{chars}]+"
 t_text = r"."
 
 def t_error(t):
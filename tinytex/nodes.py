@@ -12,69 +12,124 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
 # GNU General Public License for more details.
 
-from io import StringIO
-from functools import cached_property
+import sys
+from itertools import islice
+
 from tinymarkup.exceptions import ParseError
 
-class RootReached(Exception):
-    pass
+def _as_list(children):
+    # copy() takes ownership of lists passed to it.
+    if type(children) is list:
+        return children
+    else:
+        return list(children)
 
-class Node(object):
+class Node:
     """
     Nodes are consided immutable objects once the parser has
     run. (Property) functions that depend on append() may be cached
     because after the parser is done, append() will not be called
     again.
+
+    Some FlatNodes are shared between all places they occur in within
+    one parse tree (see TexParser.parse() and Text.intern()). Their
+    “parent” is whichever node they have been appended to last.
     """
+    __slots__ = ("_children", "parent", "scope_stack", "_text_cache",
+                 "_last_type",)
+
     def __init__(self):
         self._children = []
         self.scope_stack = []
+        self._text_cache = None
+
+        # The class of the last child append()ed, so the parser can
+        # coalesce whitespace cheaply.
+        self._last_type = None
 
     def append(self, child):
         self._children.append(child)
+        self._last_type = child.__class__
         child.parent = self
+
+        # A cached text implies cached texts on all descendants (see
+        # text below), so we may stop at the first node without one.
+        here = self
+        while here is not None and here._text_cache is not None:
+            here._text_cache = None
+            here = getattr(here, "parent", None)
+
         return child
 
     @property
     def children(self):
-        yield from iter(self._children)
+        """
+        The list of this node’s children. Do not modify it.
+        """
+        return self._children
 
     def walk(self, node_classes):
         """
         Perform an in-order pass of this Node and yield all instances of
         “node_classes”.
         """
-        for child in self._children:
-            if isinstance(child, node_classes):
-                yield child
-            for grandchild in child.walk(node_classes):
-                yield grandchild
+        stack = list(reversed(self._children))
+        while stack:
+            node = stack.pop()
+            if isinstance(node, node_classes):
+                yield node
+            if node._children:
+                stack.extend(reversed(node._children))
 
     def first(self, node_classes):
-        for child in self._children:
-            if isinstance(child, node_classes):
-                return child
-            else:
-                ret = child.first(node_classes)
-                if ret is not None:
-                    return ret
+        """
+        Return the first node yielded by walk(node_classes) or None.
+        """
+        stack = list(reversed(self._children))
+        while stack:
+            node = stack.pop()
+            if isinstance(node, node_classes):
+                return node
+            elif node._children:
+                stack.extend(reversed(node._children))
 
         return None
 
     def walk_up_to(self, NodeClass):
+        """
+        Return the closest instance of “NodeClass” among this node and
+        its ancestors or None, if there is none below the Root.
+        """
         here = self
         while True:
-            if isinstance(here, NodeClass):
+            cls = here.__class__
+            # The identity checks cover the common cases,
+            # isinstance() is only needed for subclasses.
+            if cls is NodeClass:
+                return here
+            elif cls is Root:
+                return None
+            elif isinstance(here, NodeClass):
                 return here
-            elif isinstance(here, Root):
-                raise RootReached()
             else:
                 here = here.parent
 
-    def print(self, level=0):
-        print(level*"  ", repr(self))
-        for child in self.children:
-            child.print(level+1)
+    def print(self, level=0, file=None):
+        """
+        Print this node and its descendants, one per line, indented
+        by depth. The lines are collected and written in one go.
+        """
+        lines = []
+        stack = [ (level, self) ]
+        while stack:
+            level, node = stack.pop()
+            lines.append(level*"  " + " " + repr(node) + "\n")
+            stack.extend((level+1, child)
+                         for child in reversed(node.children))
+
+        if file is None:
+            file = sys.stdout
+        file.write("".join(lines))
 
     def _repr_info(self):
         return ""
@@ -85,20 +140,42 @@ class Node(object):
             info = f" “{info}” "
         return f"{self.__class__.__name__}{info}({len(self._children)})"
 
-    @cached_property
+    @property
     def text(self):
-        ret = StringIO()
-        for node in self.walk(FlatNode):
-            ret.write(str(node))
-
-        return ret.getvalue()
+        """
+        The concatenation of all FlatNodes below this node. The result
+        is cached on this node and on all its descendants.
+        """
+        if self._text_cache is None:
+            # Fill in the caches bottom up using an explicit stack of
+            # (node, iterator over its children, their texts).
+            stack = [ (self, iter(self._children), []) ]
+            while stack:
+                node, children, parts = stack[-1]
+                for child in children:
+                    if isinstance(child, FlatNode):
+                        parts.append(str(child))
+                    elif isinstance(child, LeafNode):
+                        pass
+                    elif child._text_cache is not None:
+                        parts.append(child._text_cache)
+                    else:
+                        stack.append( (child, iter(child._children), []) )
+                        break
+                else:
+                    stack.pop()
+                    node._text_cache = "".join(parts)
+                    if stack:
+                        stack[-1][2].append(node._text_cache)
+
+        return self._text_cache
 
     def __str__(self):
         return self.text
 
     def copy(self, children):
         ret = self.__class__()
-        ret._children = list(children)
+        ret._children = _as_list(children)
         return ret
 
     @property
@@ -116,38 +193,55 @@ class Node(object):
             return None
 
 class Root(Node):
-    pass
+    __slots__ = ()
 
 class Environment(Node):
+    __slots__ = ("environment",)
+
     def __init__(self, environment):
         super().__init__()
         self.environment = environment
 
     def copy(self, children):
         ret = self.__class__(self.environment)
-        ret._children = list(children)
+        ret._children = _as_list(children)
         return ret
 
     def _repr_info(self):
         return self.environment
 
 class Command(Node):
+    __slots__ = ("command", "asterisk", "name", "parser_location",
+                 "_opt", "_req",)
+
     def __init__(self, command, parser_location=None):
         super().__init__()
-        self.command = command
+
+        # Command names are looked up in dicts and sets all the time.
+        # Interned, they are mostly found by identity.
+        self.command = command = sys.intern(command)
 
         if command[-1] == "*":
             self.asterisk = True
-            self.name = command[:-1]
+            self.name = sys.intern(command[:-1])
         else:
             self.asterisk = False
             self.name = command
 
         self.parser_location = parser_location
 
+        # The parameters sorted by kind, maintained by append().
+        self._opt = []
+        self._req = []
+
     def copy(self, children):
         ret = self.__class__(self.command, self.parser_location)
-        ret._children = list(children)
+        ret._children = _as_list(children)
+        for child in ret._children:
+            if isinstance(child, OptionalParameter):
+                ret._opt.append(child)
+            elif isinstance(child, RequiredParameter):
+                ret._req.append(child)
         return ret
 
     def _repr_info(self):
@@ -156,63 +250,98 @@ class Command(Node):
     def append(self, child):
         assert isinstance(child, (OptionalParameter,
                                   RequiredParameter)), TypeError(repr(child))
+        if isinstance(child, OptionalParameter):
+            self._opt.append(child)
+        elif isinstance(child, RequiredParameter):
+            self._req.append(child)
         return super().append(child)
 
-    @cached_property
+    @property
     def parameters(self):
         """
-        Return a list of command parameters.
+        The list of command parameters. Do not modify it.
         """
-        return tuple(self._children)
+        return self._children
 
-    @cached_property
+    @property
     def optional_parameters(self):
-        return tuple([p for p in self._children
-                      if isinstance(p, OptionalParameter)])
+        """
+        The list of OptionalParameter children. Do not modify it.
+        """
+        return self._opt
 
-    @cached_property
+    @property
     def required_parameters(self):
-        return tuple([p for p in self._children
-                      if isinstance(p, RequiredParameter)])
+        """
+        The list of RequiredParameter children. Do not modify it.
+        """
+        return self._req
 
 class OptionalParameter(Node):
-    pass
+    __slots__ = ()
 
 class RequiredParameter(Node):
-    pass
+    __slots__ = ()
+
+class LeafNode(Node):
+    """
+    A node that never has children. Leaves make up most of a parse
+    tree, so they share an empty tuple as their list of children and
+    skip the rest of Node’s bookkeeping.
+    """
+    __slots__ = ()
 
-class LineBreak(Node):
-    pass
+    # Shadows Node’s slot, which a LeafNode never sets.
+    _children = ()
 
-class ParagraphBreak(Node):
-    pass
+    def __init__(self):
+        pass
 
-class FlatNode(Node):
     def append(self, child):
-        raise NotImplemented()
+        raise TypeError(f"{self.__class__.__name__} may not "
+                        f"contain child nodes.")
 
-    def __str__(self):
-        raise NotImplemented()
+    def walk(self, node_classes):
+        return iter(())
 
-    def __repr__(self):
-        return f"{self.__class__.__name__}(-)"
+    def first(self, node_classes):
+        return None
 
-    def copy(self, children=[]):
-        children = list(children)
-        if len(children) > 0:
+    @property
+    def text(self):
+        return ""
+
+    def copy(self, children=()):
+        if next(iter(children), None) is not None:
             raise ValueError(f"{self.__class__.__name__} may not "
                              f"contain child notes.")
         return self.__class__()
 
+class LineBreak(LeafNode):
+    __slots__ = ()
+
+class ParagraphBreak(LeafNode):
+    __slots__ = ()
+
+class FlatNode(LeafNode):
+    __slots__ = ()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(-)"
+
 
 class ScopeDelim(FlatNode):
-    pass
+    __slots__ = ()
+
+    def __str__(self):
+        # Curly braces group, they don’t contribute to the text.
+        return ""
 
 class BeginScope(ScopeDelim):
     # This is an open curly brace that’s not a paramter.
+    __slots__ = ("parser_location", "end",)
 
     def __init__(self, parser_location):
-        super().__init__()
         self.parser_location = parser_location
 
     def copy(self, children=[]):
@@ -227,30 +356,47 @@ class BeginScope(ScopeDelim):
         if not hasattr(self, "end"):
             raise ParseError("Scope not yet closed.")
 
-        siblings = list(self.parent.children)
-        while siblings and siblings[0] != self:
-            siblings.pop(0)
-        siblings.pop(0) # Drop self
-
-        while siblings[0] != self.end:
-            yield siblings.pop(0)
+        siblings = self.parent.children
+        for node in islice(siblings, siblings.index(self)+1, None):
+            if node is self.end:
+                break
+            yield node
 
 class EndScope(ScopeDelim):
     # This is an closing curly brace that’s not a paramter.
-    pass
+    __slots__ = ("begin",)
 
 class Whitespace(FlatNode):
+    __slots__ = ()
+
     def __str__(self):
         return " "
 
 class Text(FlatNode):
+    __slots__ = ("_text",)
+
     def __init__(self, text):
-        super().__init__()
         self._text = text
 
     def copy(self, children=None):
         return self.__class__(self._text)
 
+    @classmethod
+    def intern(cls, text, pool):
+        """
+        Return a shared instance for short texts, which re-occur all
+        over a document, and a new one for longer texts. “pool” is a
+        dict owned by the caller, usually one per parse, so the shared
+        instances go away with the tree.
+        """
+        if len(text) > 8:
+            return cls(text)
+
+        ret = pool.get(text)
+        if ret is None:
+            ret = pool[text] = cls(text)
+        return ret
+
     @property
     def text(self):
         return self._text
@@ -262,6 +408,9 @@ class Text(FlatNode):
         return f"{self.__class__.__name__}(“{self.text}”)"
 
 class Placeholder(Text):
+    __slots__ = ("no",)
+
     def __init__(self, text):
-        super().__init__(text)
-        self.no = int(text[1:])
+        self._text = text
+        # The lexer only matches a # followed by a single digit 1-9.
+        self.no = ord(text[1]) - 48
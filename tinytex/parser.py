@@ -12,152 +12,184 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
 # GNU General Public License for more details.
 
-import sys, re, dataclasses, copy
+import os, re
 
 import ply.lex
 
-from tinymarkup.exceptions import (InternalError, ParseError, UnknownMacro,
-                                   Location, UnsuitableMacro)
+from tinymarkup.exceptions import ParseError
 from tinymarkup.parser import Parser
 
 from .compiler import TexCompiler
 from . import lextokens
-from .nodes import (RootReached, Node, Root, Environment, Command,
+from .nodes import (Root, Environment, Command,
                     OptionalParameter, RequiredParameter,
                     LineBreak, ParagraphBreak, BeginScope, EndScope,
                     Whitespace, Text, Placeholder)
 from .user_commands import resolve_user_commands
 
+# The lexer tables are cached in _lextab.py. Run bin/regen_lextab.py
+# whenever lextokens changes.
 tex_base_lexer = ply.lex.lex(module=lextokens,
-                             reflags=re.MULTILINE|re.IGNORECASE|re.DOTALL,
-                             optimize=False,
-                             lextab=None)
+                             reflags=re.MULTILINE,
+                             debug=False,
+                             optimize=1,
+                             lextab="tinytex._lextab",
+                             outputdir=os.path.dirname(__file__))
 
 class TexParser(Parser):
     def __init__(self):
         super().__init__(tex_base_lexer)
 
     def parse(self, source:str, compiler:TexCompiler):
-        root = here = Root()
+        handlers = self._handlers
+
+        root = Root()
+
+        # Whitespace and short Text nodes are shared within this parse
+        # tree.
+        self._whitespace = Whitespace()
+        self._text_pool = {}
+
+        # The nodes from the root down to the one we’re in.
+        stack = [ root ]
         for token in self.lexer.tokenize(source):
-            def require_context(NodeClass):
-                if not isinstance(here, NodeClass):
-                    raise ParseError("Context required: %s" % (
-                        NodeClass.__name__), location=self.location)
-
-            match token.type:
-                case "begin_environment":
-                    if here.scope_stack:
-                        raise ParseError("Can’t begin an environment within "
-                                         "a scope.", location=self.location)
-
-                    here = here.append(Environment(token.value))
-
-                case "end_environment":
-                    if here.scope_stack:
-                        raise ParseError("Environment not closed.",
-                                         location=self.location)
-
-                    try:
-                        here = here.walk_up_to(Environment)
-                    except RootReached:
-                        raise ParseError("Not in an environment.",
-                                         location=self.location)
-                    if here.environment != token.value:
-                        raise ParseError(f"Not in a “{tokebn.value}” "
-                                         "environment.",
-                                         location=self.location)
-                    here = here.parent
-
-                case "command":
-                    if isinstance(here, Command):
-                        here = here.parent
-
-                    # Locations are (rather) expensive. Let’s not create
-                    # one for each command.
-                    if token.value in { "newcommand", "renewcommand",
-                                        # These currently won’t work.
-                                        # "newcommand*", "renewcommand*",
-                                        "NewDocumentCommand", }:
-                        location = self.location
-                    else:
-                        location = None
-
-                    here = here.append(Command(
-                        token.value, parser_location=location))
-
-                case "open_oparam":
-                    require_context(Command)
-                    here = here.append(OptionalParameter())
-
-                case "close_oparam":
-                    if isinstance(here, Command):
-                        here = here.parent
-
-                    require_context(OptionalParameter)
-                    here = here.parent
-
-                case "open_curly":
-                    if isinstance(here, Command):
-                        here = here.append(RequiredParameter())
-                    else:
-                        begin = BeginScope(self.location)
-                        here.scope_stack.append(begin)
-                        here.append(begin)
-
-                case "close_curly":
-                    if here.scope_stack:
-                        begin = here.scope_stack.pop()
-
-                        end = EndScope()
-
-                        end.begin = begin
-                        begin.end = end
-                        here.append(end)
-                    else:
-                        if isinstance(here, Command):
-                            # There was a command without parameters?
-                            try:
-                                here = here.parent.walk_up_to(Command)
-                            except RootReached:
-                                raise ParseError(
-                                    "Closing curly brace without opening (1).",
-                                    location=self.location)
-
-                        elif isinstance(here, RequiredParameter):
-                            # This is the end of a RequiredParameter
-                            here = here.walk_up_to(Command)
-                        else:
-                            # A } without context.
-                            raise ParseError(
-                                "Closing curly brace without opening (2).",
-                                location=self.location)
-
-                case "linebreak":
-                    here.append(LineBreak())
-
-                case "eols":
-                    if isinstance(here, Command):
-                        here = here.parent
-                    if not isinstance(here.last_child, ParagraphBreak):
-                        here.append(ParagraphBreak())
-
-                case "comment":
-                    pass
-
-                case "whitespace":
-                    if isinstance(here, Command):
-                        here = here.parent
-
-                    if not isinstance(here.last_child, Whitespace):
-                        here.append(Whitespace())
-
-                case "placeholder":
-                    here.append(Placeholder(token.value))
-
-                case "word"|"text":
-                    if isinstance(here, Command):
-                        here = here.parent
-                    here.append(Text(token.value))
-
-        root = resolve_user_commands(root)
+            handlers[token.type](self, token, stack)
+
+        return resolve_user_commands(root)
+
+    def require_context(self, here, NodeClass):
+        if here.__class__ is not NodeClass:
+            raise ParseError("Context required: %s" % (
+                NodeClass.__name__), location=self.location)
+
+    def _h_begin_environment(self, token, stack):
+        here = stack[-1]
+        if here.scope_stack:
+            raise ParseError("Can’t begin an environment within "
+                             "a scope.", location=self.location)
+
+        stack.append(here.append(Environment(token.value)))
+
+    def _h_end_environment(self, token, stack):
+        if stack[-1].scope_stack:
+            raise ParseError("Environment not closed.",
+                             location=self.location)
+
+        while stack[-1].__class__ is not Environment:
+            if len(stack) == 1:
+                raise ParseError("Not in an environment.",
+                                 location=self.location)
+            stack.pop()
+
+        if stack[-1].environment != token.value:
+            raise ParseError(f"Not in a “{token.value}” "
+                             "environment.",
+                             location=self.location)
+        stack.pop()
+
+    def _h_command(self, token, stack, location=None):
+        if stack[-1].__class__ is Command:
+            stack.pop()
+
+        stack.append(stack[-1].append(
+            Command(token.value, parser_location=location)))
+
+    def _h_user_def_command(self, token, stack):
+        # Locations are (rather) expensive. Let’s only create
+        # them for user command definitions, which need them for
+        # error reporting.
+        self._h_command(token, stack, self.location)
+
+    def _h_open_oparam(self, token, stack):
+        self.require_context(stack[-1], Command)
+        stack.append(stack[-1].append(OptionalParameter()))
+
+    def _h_close_oparam(self, token, stack):
+        if stack[-1].__class__ is Command:
+            stack.pop()
+
+        self.require_context(stack[-1], OptionalParameter)
+        stack.pop()
+
+    def _h_open_curly(self, token, stack):
+        here = stack[-1]
+        if here.__class__ is Command:
+            stack.append(here.append(RequiredParameter()))
+        else:
+            begin = BeginScope(self.location)
+            here.scope_stack.append(begin)
+            here.append(begin)
+
+    def _h_close_curly(self, token, stack):
+        here = stack[-1]
+        if here.scope_stack:
+            begin = here.scope_stack.pop()
+
+            end = EndScope()
+
+            end.begin = begin
+            begin.end = end
+            here.append(end)
+        elif here.__class__ is Command:
+            # There was a command without parameters? Then this
+            # closes the parameter of a command further up.
+            stack.pop()
+            while stack[-1].__class__ is not Command:
+                if len(stack) == 1:
+                    raise ParseError(
+                        "Closing curly brace without opening (1).",
+                        location=self.location)
+                stack.pop()
+        elif here.__class__ is RequiredParameter:
+            # This is the end of a RequiredParameter
+            stack.pop()
+        else:
+            # A } without context.
+            raise ParseError(
+                "Closing curly brace without opening (2).",
+                location=self.location)
+
+    def _h_linebreak(self, token, stack):
+        stack[-1].append(LineBreak())
+
+    def _h_eols(self, token, stack):
+        if stack[-1].__class__ is Command:
+            stack.pop()
+
+        here = stack[-1]
+        if here._last_type is not ParagraphBreak:
+            here.append(ParagraphBreak())
+
+    def _h_whitespace(self, token, stack):
+        if stack[-1].__class__ is Command:
+            stack.pop()
+
+        here = stack[-1]
+        if here._last_type is not Whitespace:
+            here.append(self._whitespace)
+
+    def _h_placeholder(self, token, stack):
+        stack[-1].append(Placeholder(token.value))
+
+    def _h_text(self, token, stack):
+        if stack[-1].__class__ is Command:
+            stack.pop()
+        stack[-1].append(Text.intern(token.value, self._text_pool))
+
+    # Map token types to the methods handling them. Each handler is
+    # called with the token and the stack of nodes we’re in, which it
+    # updates in place.
+    _handlers = { "begin_environment": _h_begin_environment,
+                  "end_environment": _h_end_environment,
+                  "command": _h_command,
+                  "user_def_command": _h_user_def_command,
+                  "open_oparam": _h_open_oparam,
+                  "close_oparam": _h_close_oparam,
+                  "open_curly": _h_open_curly,
+                  "close_curly": _h_close_curly,
+                  "linebreak": _h_linebreak,
+                  "eols": _h_eols,
+                  "whitespace": _h_whitespace,
+                  "placeholder": _h_placeholder,
+                  "word": _h_text,
+                  "text": _h_text, }
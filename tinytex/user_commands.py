@@ -12,154 +12,342 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
 # GNU General Public License for more details.
 
-from functools import cached_property
-from collections import deque
+import sys
+from operator import is_
+from itertools import takewhile
 
 from tinymarkup.exceptions import ParseError
-from .nodes import (RootReached, Node, Root, Environment, Command,
-                    OptionalParameter, RequiredParameter,
-                    LineBreak, ParagraphBreak, BeginScope, EndScope,
-                    Whitespace, Text, Placeholder)
+from .nodes import (Root, Environment, Command, BeginScope, EndScope,
+                    Text, Placeholder)
 
 class UserCommandParseError(ParseError):
     pass
 
+# The names of the commands that define user commands.
+definition_commands = frozenset(map(sys.intern, (
+    "newcommand", "renewcommand",
+    # These currently won’t work.
+    # "newcommand*", "renewcommand*",
+    "NewDocumentCommand", )))
+
+def user_command_from(command, siblings):
+    r"""
+    Create the UserCommand object for a definition command. “siblings”
+    is an iterator over the nodes following it. \NewDocumentCommand
+    takes its definition from there.
+    """
+    if command.name == "NewDocumentCommand":
+        newcommand = next(siblings, None)
+        if newcommand.__class__ is not Command:
+            raise UserCommandParseError(
+                "NewDocumentCommand must be followed by the command "
+                "it defines.",
+                location=command.parser_location)
+        return XParseDocumentCommand(command, newcommand)
+    else:
+        return OldStyleNewCommand(command)
+
+# The nodes that may contain user command definitions. Commands and
+# their parameters, definition bodies included, are not searched.
+_container_types = (Root, Environment,)
+
 def find_user_commands(root):
     r"""
-    Recursively search for user command definitions (\newcommand,
+    Search the tree for user command definitions (\newcommand,
     \renewcommand and \NewDocumentCommand) and yield UserCommand
-    objects.
+    objects in document order.
     """
-    children = iter(root.children)
-    for child in children:
-        if isinstance(child, Command):
-            if child.name in { "newcommand", "renewcommand", }:
-                yield OldStyleNewCommand(child)
-            elif child.name == "NewDocumentCommand":
-                yield XParseDocumentCommand(child, next(children))
+    # A stack of iterators over the children of the nodes we’re in.
+    stack = [ iter(root.children) ]
+    while stack:
+        children = stack[-1]
+        for child in children:
+            if child.__class__ is Command:
+                if child.name in definition_commands:
+                    yield user_command_from(child, children)
+            elif isinstance(child, _container_types):
+                stack.append(iter(child.children))
+                break
         else:
-            for cmd in find_user_commands(child):
-                yield cmd
+            stack.pop()
+
+# The number of user command expansions that may be nested inside each
+# other. A user command that (indirectly) expands to itself without end
+# hits this limit, much like TeX’s “capacity exceeded”.
+max_expansion_depth = 256
 
 def resolve_user_commands(root, extra_user_commands={}):
     """
     Return a recursive copy of this node with the user
     commands resolved.
+
+    Definitions take effect where they occur, as they do in TeX: A
+    user command used before its definition is left alone. Like
+    find_user_commands(), only definitions in the Root and its
+    Environments count, including those user command expansions put
+    there. Definitions elsewhere are dropped. The commands in
+    “extra_user_commands” are known throughout and take precedence
+    over definitions in the document.
     """
-    user_commands = dict([(cmd.name, cmd,)
-                          for cmd in find_user_commands(root)])
-    user_commands.update(extra_user_commands)
-
-    def process(node):
-        def newchildren(children):
-            scopes = []
-            for child in children:
-                if isinstance(child, Command):
-                    if child.name in { "newcommand", "renewcommand" }:
-                        pass
-                    elif child.name == "NewDocumentCommand":
-                        # Skip the next command node so the
-                        # command definition does not get called.
-                        next(children)
-                    elif child.name in user_commands:
-                        usercmd = user_commands[child.name]
-                        for newnode in usercmd.call(child):
-                            yield process(newnode)
-                    else:
-                        yield process(child)
-                elif isinstance(child, BeginScope):
-                    newbegin = child.copy() # No need to process().
-                    scopes.append(newbegin)
-                    yield newbegin
-                elif isinstance(child, EndScope):
-                    newend = child.copy()
-                    newbegin = scopes.pop()
-                    newbegin.end = newend
-                    newend.begin = newbegin
-                    yield newend
+    user_commands = dict(extra_user_commands)
+
+    # The tree is copied depth first using a stack of frames rather
+    # than recursion. Each frame holds a node, the iterator over its
+    # children, the list of their copies and the stack of the scopes
+    # opened among them. A frame is copied when its iterator runs dry.
+    # User command expansions get a frame without a node that shares
+    # its parent’s lists, so their nodes are spliced into the parent.
+    # Definitions are collected along the way and dropped from the
+    # copy. The last items of a frame are the number of expansions it is
+    # nested in, which stops runaway recursive user commands, and
+    # whether definitions among its children count.
+    stack = [ [ root, iter(root.children), [], [], 0, True, ] ]
+    while True:
+        node, children, newchildren, scopes, depth, collect = stack[-1]
+        for child in children:
+            # None of these classes is subclassed, identity checks
+            # will do.
+            cls = child.__class__
+            if cls is Command:
+                if child.name in definition_commands:
+                    usercmd = user_command_from(child, children)
+                    if collect and usercmd.name not in extra_user_commands:
+                        user_commands[usercmd.name] = usercmd
+                elif child.name in user_commands:
+                    # The expansion is processed as if it had been
+                    # in the source at this point, user commands
+                    # it uses included.
+                    usercmd = user_commands[child.name]
+                    if depth >= max_expansion_depth:
+                        raise UserCommandParseError(
+                            f"Capacity exceeded: More than "
+                            f"{max_expansion_depth} nested expansions "
+                            f"of user commands at “\\{child.command}”.",
+                            location=(child.parser_location
+                                      or usercmd.parser_location))
+                    stack.append([ None, iter(usercmd.call(child)),
+                                   newchildren, scopes, depth+1,
+                                   collect, ])
+                    break
                 else:
-                    yield process(child)
-
-        return node.copy(newchildren(node.children))
-
-    return process(root)
+                    stack.append([ child, iter(child.children),
+                                   [], [], depth, False, ])
+                    break
+            elif cls is BeginScope:
+                newbegin = child.copy() # No need to process().
+                scopes.append(newbegin)
+                newchildren.append(newbegin)
+            elif cls is EndScope:
+                newend = child.copy()
+                newbegin = scopes.pop()
+                newbegin.end = newend
+                newend.begin = newbegin
+                newchildren.append(newend)
+            elif child.children:
+                stack.append([ child, iter(child.children),
+                               [], [], depth,
+                               collect and cls in _container_types, ])
+                break
+            else:
+                # Nodes are immutable once the parser is done, so
+                # childless ones may be shared with the new tree.
+                newchildren.append(child)
+        else:
+            stack.pop()
+            if node is None:
+                continue
+
+            if len(newchildren) == len(node.children) \
+               and all(map(is_, newchildren, node.children)):
+                # Nothing changed below this node, so it may be
+                # shared with the new tree.
+                newnode = node
+            else:
+                newnode = node.copy(newchildren)
+
+            if stack:
+                stack[-1][2].append(newnode)
+            else:
+                return newnode
+
+# The opcodes of compiled user command definitions, see
+# UserCommand._compile().
+EMIT, SUBST, OPEN, CLOSE = range(4)
 
 class Argument(object):
-    pass
+    """
+    Base class of the arguments in an xparse argspec. Subclasses
+    provide value(rparams, oparams), which takes the argument’s
+    parameter from the iterators over a call’s required and optional
+    parameters and returns the nodes to substitute for it.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_nodes(Argument, letter, nodes, location=None):
+        """
+        Create the argument for “letter” in an xparse argspec. “nodes”
+        is the iterator over the argspec’s nodes that follow the
+        letter’s, “location” that of the definition for error messages.
+        """
+        return Argument()
 
 class Mandetory(Argument):
-    pass
+    __slots__ = ()
+
+    def value(self, rparams, oparams):
+        return next(rparams).children
 
 class Optional(Argument):
-    def __init__(self, default=None):
+    __slots__ = ("default",)
+
+    def __init__(self, default=()):
+        # The sequence of nodes used if the call omits the parameter.
         self.default = default
 
+    def value(self, rparams, oparams):
+        param = next(oparams, None)
+        if param is None:
+            return self.default
+        else:
+            return param.children
+
     @classmethod
-    def from_nodes(Optional, letter, nodes):
-        begin = next(nodes)
+    def from_nodes(Optional, letter, nodes, location=None):
+        if letter == "o":
+            return Optional()
+
+        begin = next(nodes, None)
         if not isinstance(begin, BeginScope):
             raise UserCommandParseError(
                 "“O” argument must be "
                 "followed by {}-Scope.",
-                location=self.parser_location)
+                location=location)
 
+        # Collect the nodes up to the matching EndScope in the same
+        # pass that skips them. takewhile() consumes the EndScope, too.
         end = begin.end
-        scope = begin.assemble()
-
-        here = next(nodes)
-        while not here is end:
-            here = next(nodes)
-
-        return Optional(scope)
+        return Optional(tuple(takewhile(lambda node: node is not end,
+                                        nodes)))
 
 
     def __repr__(self):
         return f"<{self.__class__.__name__} {{{repr(self.default)}}}"
 
+# The xparse argspec letters we understand and the factories of their
+# Argument objects.
+_argspec_letters = { "m": Mandetory.from_nodes,
+                     "o": Optional.from_nodes,
+                     "O": Optional.from_nodes, }
+_argspec_skip = frozenset(" \t\n")
 
 class UserCommand(object):
+    __slots__ = ("parser_location", "argspecs", "definition", "_arg_fns",
+                 "_ops", "_default_expansion",)
+
+    def __init__(self):
+        # The expansion of a call without parameters, see call().
+        self._default_expansion = None
+
+    def clear_cache(self):
+        """
+        Forget the expansion remembered by call().
+        """
+        self._default_expansion = None
+
+    def _compile(self, nodes, ops=None):
+        """
+        Turn a definition’s nodes into the flat list of instructions
+        call() executes. Each is a pair (opcode, argument):
+
+        EMIT, list of nodes — Output these nodes as they are. Used for
+                              runs of nodes without placeholders below
+                              them.
+        SUBST, index        — Output the nodes of the parameter at that
+                              index, i.e. the placeholder’s number - 1.
+        OPEN, None          — Start collecting a node’s children.
+        CLOSE, node         — Output a copy of node with the children
+                              collected since the matching OPEN.
+        """
+        if ops is None:
+            ops = []
+
+        for node in nodes:
+            if node.__class__ is Placeholder:
+                if node.no > len(self.argspecs):
+                    raise UserCommandParseError(
+                        f"Illegal parameter number “{node.text}” in "
+                        f"definition with {len(self.argspecs)} "
+                        f"argument(s).",
+                        location=self.parser_location)
+                ops.append( (SUBST, node.no-1,) )
+            elif node.first(Placeholder) is None:
+                if ops and ops[-1][0] == EMIT:
+                    ops[-1][1].append(node)
+                else:
+                    ops.append( (EMIT, [ node ],) )
+            else:
+                ops.append( (OPEN, None,) )
+                self._compile(node.children, ops)
+                ops.append( (CLOSE, node,) )
+
+        return ops
+
     def call(self, command):
         """
         Return a recursive copy of our definition with the placeholders
-        replaced by the call’s parameters.
+        replaced by the call’s parameters as a tuple of nodes.
+
+        A call without parameters uses the defaults for all arguments
+        and always expands to the same nodes. Its expansion is
+        remembered and the same tuple returned for each such call.
+        resolve_user_commands() builds its own copies of the nodes.
         """
-        rparams = deque(command.required_parameters)
-        oparams = deque(command.optional_parameters)
-
-        def argument_values():
-            for spec in self.argspecs:
-                if isinstance(spec, Mandetory):
-                    yield rparams.popleft().children
-                elif isinstance(spec, Optional):
-                    if oparams:
-                        arg = oparams.popleft()
-                    else:
-                        arg = None
-
-                    if arg is None:
-                        yield spec.default
-                    else:
-                        yield arg.children
-                else:
-                    raise TypeError()
+        if not command.children and self._default_expansion is not None:
+            return self._default_expansion
+
+        rparams = iter(command.required_parameters)
+        oparams = iter(command.optional_parameters)
 
+        # A plain loop; before Python 3.12, a list comprehension runs
+        # in a function frame of its own.
+        parameters = []
         try:
-            parameters = tuple(argument_values())
-        except IndexError as ie:
+            for fn in self._arg_fns:
+                parameters.append(fn(rparams, oparams))
+        except StopIteration as si:
             raise UserCommandParseError(
                 f"Mismatch of arguments between definition and call of "
                 f"“\\{command.command}”.",
-                location=command.parser_location) from ie
+                location=command.parser_location) from si
 
-        def walk(nodes):
-            for node in nodes:
-                if isinstance(node, Placeholder):
-                    yield from parameters[node.no-1]
-                else:
-                    yield node.copy(walk(node._children))
+        ret = out = []
+        stack = []
+        for opcode, argument in self._ops:
+            if opcode == EMIT:
+                out.extend(argument)
+            elif opcode == SUBST:
+                out.extend(parameters[argument])
+            elif opcode == OPEN:
+                stack.append(out)
+                out = []
+            else: # CLOSE
+                node = argument.copy(out)
+                out = stack.pop()
+                out.append(node)
+
+        ret = tuple(ret)
 
-        yield from walk(self.definition)
+        if not command.children:
+            self._default_expansion = ret
 
+        return ret
+
+
+# The empty optional argument default, by far the most common one, is
+# shared by all definitions that use it. Other defaults get a Text node
+# of their own, so no node outlives its document.
+_empty_default = Text("")
 
 class OldStyleNewCommand(UserCommand):
     """
@@ -217,6 +405,8 @@ class OldStyleNewCommand(UserCommand):
 
     https://latexref.xyz/_005cnewcommand-_0026-_005crenewcommand.html
     """
+    __slots__ = ("rparams", "name",)
+
     def __init__(self, command):
         super().__init__()
 
@@ -229,15 +419,18 @@ class OldStyleNewCommand(UserCommand):
             nargs = 0
             optargdefault = None
         elif len(optparams) > 0:
+            # Node.text is cached; str() would only go through
+            # __str__() to get it.
+            nargs = optparams[0].text
             try:
-                nargs = int(str(optparams[0]))
+                nargs = int(nargs)
             except ValueError:
                 raise UserCommandParseError(
                     f"Can’t parse number of arguments “{nargs}”",
-                    location=self.command.parser_location)
+                    location=self.parser_location)
 
         if len(optparams) > 1:
-            optargdefault = str(optparams[-1])
+            optargdefault = optparams[-1].text
             wants_optional_parameter = True
         else:
             wants_optional_parameter = False
@@ -245,37 +438,46 @@ class OldStyleNewCommand(UserCommand):
         if len(self.rparams) != 2:
             raise UserCommandParseError(
                 f"\(re)newcommand requires two parameters.",
-                location=self.command.parser_location)
+                location=self.parser_location)
+
+        command = rparams[0].first(Command)
+        if command is None:
+            raise UserCommandParseError(
+                "\(re)newcommand’s first param "
+                "must be a command to (re-)define.",
+                location=self.parser_location)
+        self.name = command.name
 
         argspecs = []
         if wants_optional_parameter:
-            argspecs.append(Optional(Text(optargdefault)))
+            if optargdefault:
+                default = Text(optargdefault)
+            else:
+                default = _empty_default
+            argspecs.append(Optional( (default,) ))
             nargs -= 1
 
         for a in range(nargs):
             argspecs.append(Mandetory())
 
         self.argspecs = tuple(argspecs)
-
-    @cached_property
-    def name(self):
-        command = self.rparams[0].first(Command)
-        if command is None:
-            raise UserCommandParseError(
-                "\(re)newcommand’s first param "
-                "must be a command to (re-)define.",
-                location=self.command.parser_location)
-        return command.name
-
-    @property
-    def definition(self):
-        yield from self.rparams[-1].children
+        self._arg_fns = tuple([ spec.value for spec in self.argspecs ])
+        self.definition = tuple(rparams[-1].children)
+        self._ops = self._compile(self.definition)
 
     def __repr__(self):
         me = self.__class__.__name__
-        return f"<{me}({self.nargs}, {repr(self.optargdefault)})>"
+        nargs = len(self.argspecs)
+        if nargs and self.argspecs[0].__class__ is Optional:
+            optargdefault = "".join([ node.text
+                                      for node in self.argspecs[0].default ])
+        else:
+            optargdefault = None
+        return f"<{me}({nargs}, {repr(optargdefault)})>"
 
 class XParseDocumentCommand(UserCommand):
+    __slots__ = ("name",)
+
     def __init__(self, command, newcommand):
         super().__init__()
 
@@ -290,19 +492,21 @@ class XParseDocumentCommand(UserCommand):
 
         argspecs, definition = newcommand.required_parameters
         self.argspecs = tuple(self.parse_argspecs(argspecs))
-        self.definition = definition.children
+        self._arg_fns = tuple([ spec.value for spec in self.argspecs ])
+        self.definition = tuple(definition.children)
+        self._ops = self._compile(self.definition)
 
     def parse_argspecs(self, rargs):
-        nodes = rargs.children
+        nodes = iter(rargs.children)
         for node in nodes:
             if isinstance(node, Text):
-                letters = node.text
-                for letter in letters:
-                    if letter in " \t\n":
-                        pass
-                    elif letter == "m":
-                        yield Mandetory()
-                    elif letter == "o":
-                        yield Optional()
-                    elif letter == "O":
-                        yield Optional.from_nodes(node, nodes)
+                for letter in node.text:
+                    if letter in _argspec_skip:
+                        continue
+
+                    factory = _argspec_letters.get(letter)
+                    if factory is None:
+                        raise UserCommandParseError(
+                            f"Unsupported argument specifier “{letter}”.",
+                            location=self.parser_location)
+                    yield factory(letter, nodes, self.parser_location)